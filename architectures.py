@@ -1,15 +1,114 @@
+import functools
+import math
 from abc import ABC, abstractmethod
 import numpy as np
 import networkx as nx
-from matplotlib import pyplot as plt
-from qiskit.providers.fake_provider import FakeMumbaiV2, FakeLagosV2, FakeGuadalupeV2, FakeWashingtonV2, FakeQuitoV2
+
+_FAKE_BACKENDS = {5: "FakeQuitoV2", 7: "FakeLagosV2", 16: "FakeGuadalupeV2", 27: "FakeMumbaiV2",
+                  127: "FakeWashingtonV2"}
+
+
+@functools.lru_cache(maxsize=None)
+def _build_topology(cls, system_size: int, m: int = None, n: int = None):
+    # The coupling map is pure data depending only on the constructor arguments,
+    # so identical (class, system_size, m, n) combinations share a single build.
+    arch = cls.__new__(cls)
+    arch.system_size = system_size
+    if m is not None:
+        arch.m = m
+    if n is not None:
+        arch.n = n
+    return tuple(tuple(edge) for edge in arch.get_topology())
+
+
+@functools.lru_cache(maxsize=None)
+def _load_heavyhex_coupling(system_size: int):
+    # Only the coupling_map field of the backend's conf file is needed here;
+    # instantiating the fake backend would also parse its properties/defaults
+    # and build a full Target we never read.
+    import json
+    import os
+    from qiskit.providers import fake_provider
+    backend_cls = getattr(fake_provider, _FAKE_BACKENDS[system_size])
+    path = os.path.join(backend_cls.dirname, backend_cls.conf_filename)
+    with open(path) as handle:
+        return tuple(tuple(edge) for edge in json.load(handle)["coupling_map"])
 
 
 class Architecture(ABC):
+    # Sweeps construct architectures by the thousands; slots drop the
+    # per-instance dict and make attribute reads a fixed-offset lookup.
+    __slots__ = ("system_size", "name", "coupling_map", "_qiskit_coupling_map", "_csr", "_distance_matrix")
+
     def __init__(self, system_size: int, name: str):
         self.system_size = system_size
         self.name = name
-        self.coupling_map = self.get_topology()
+        self._qiskit_coupling_map = None
+        self._csr = None
+        self._distance_matrix = None
+        # One contiguous int32 row per edge instead of a list of Python lists:
+        # ~15x smaller and traversals become C loops.
+        self.coupling_map = np.asarray(_build_topology(type(self), system_size,
+                                                       getattr(self, "m", None), getattr(self, "n", None)),
+                                       dtype=np.int32)
+
+    @property
+    def coupling_map_list(self):
+        # Compatibility view for callers that require plain lists
+        # (e.g. Qiskit's CouplingMap constructor).
+        return self.coupling_map.tolist()
+
+    @property
+    def qiskit_coupling_map(self):
+        # Built lazily and shared by every Compiler using this architecture:
+        # handing transpile a plain list makes it rebuild the CouplingMap
+        # (including its distance matrix) on every call.
+        if self._qiskit_coupling_map is None:
+            from qiskit.transpiler import CouplingMap
+            cmap = CouplingMap(self.coupling_map_list)
+            # Pre-seed Qiskit's lazily computed distance matrix with ours so
+            # routing passes don't redo the all-pairs BFS per transpile.
+            cmap._dist_matrix = self.distance_matrix.astype(float)
+            self._qiskit_coupling_map = cmap
+        return self._qiskit_coupling_map
+
+    @property
+    def csr(self):
+        # Compressed sparse rows over the edge list: indptr[v]:indptr[v+1]
+        # slices the (sorted) neighbours of v, so neighbour iteration is
+        # O(deg(v)) instead of an O(E) scan.
+        if self._csr is None:
+            edges = self.coupling_map
+            order = np.lexsort((edges[:, 1], edges[:, 0]))
+            src = edges[order, 0]
+            indptr = np.zeros(self.system_size + 1, dtype=np.int32)
+            np.add.at(indptr, src + 1, 1)
+            np.cumsum(indptr, out=indptr)
+            self._csr = (indptr, np.ascontiguousarray(edges[order, 1]))
+        return self._csr
+
+    def neighbors(self, v: int):
+        indptr, indices = self.csr
+        return indices[indptr[v]:indptr[v + 1]]
+
+    def has_edge(self, u: int, v: int):
+        row = self.neighbors(u)
+        idx = np.searchsorted(row, v)
+        return bool(idx < len(row) and row[idx] == v)
+
+    @property
+    def distance_matrix(self):
+        # All-pairs shortest paths over the coupling graph, computed once with
+        # scipy's C-level BFS and stored as int16 (device diameters are tiny).
+        if self._distance_matrix is None:
+            import scipy.sparse as sp
+            import scipy.sparse.csgraph as cg
+            indptr, indices = self.csr
+            data = np.ones_like(indices)
+            graph = sp.csr_matrix((data, indices, indptr), shape=(self.system_size,) * 2)
+            dist = cg.shortest_path(graph, method="D", directed=False, unweighted=True)
+            self._distance_matrix = dist.astype(np.int16)
+        return self._distance_matrix
 
     @abstractmethod
     def get_topology(self):
@@ -17,6 +116,8 @@ class Architecture(ABC):
 
 
 class Grid(Architecture):
+    __slots__ = ("m", "n")
+
     def __init__(self, system_size: int, m: int, n: int):
         assert system_size == m * n, "System size does not match the defined grid structure."
         self.m = m
@@ -24,41 +125,48 @@ class Grid(Architecture):
         super().__init__(system_size, "grid")
 
     def get_topology(self):
-        graph = nx.grid_2d_graph(m=self.m, n=self.n)
-        graph = nx.convert_node_labels_to_integers(graph)
-        graph = [list(e) for e in graph.edges]
-        to_add = []
-        for e in graph:
-            i, j = e
-            to_add.append([j, i])
-        graph = graph + to_add
-        return graph
+        # Row-major indexing makes the grid edges pure index arithmetic; no need
+        # to build (and throw away) a NetworkX graph.
+        idx = np.arange(self.m * self.n).reshape(self.m, self.n)
+        horizontal = np.stack([idx[:, :-1].ravel(), idx[:, 1:].ravel()], axis=1)
+        vertical = np.stack([idx[:-1, :].ravel(), idx[1:, :].ravel()], axis=1)
+        edges = np.concatenate([horizontal, vertical])
+        edges = np.concatenate([edges, edges[:, ::-1]])
+        return edges.tolist()
 
 
 class SquareGrid(Grid):
+    __slots__ = ()
+
     def __init__(self, system_size: int):
-        if not np.sqrt(system_size).is_integer():
-            exit("The system size {} is not valid for square grid topology.".format(system_size))
+        # math.isqrt is exact for arbitrary ints; float sqrt loses precision above 2**53.
+        n = math.isqrt(system_size)
+        if n * n != system_size:
+            raise ValueError("The system size {} is not valid for square grid topology.".format(system_size))
 
-        n = int(np.sqrt(system_size))
         super().__init__(system_size, m=n, n=n)
 
 
 class LineArchitecture(Architecture):
+    __slots__ = ()
+
     def __init__(self, system_size: int):
         super().__init__(system_size, "line")
 
     def get_topology(self):
-        graph = nx.path_graph(self.system_size)
-        return [list(e) for e in graph.edges]
+        # A path is just consecutive indices; no graph object needed.
+        a = np.arange(self.system_size - 1, dtype=np.int32)
+        return np.stack([a, a + 1], axis=1)
 
 
 class HeavyHexArchitecture(Architecture):
+    __slots__ = ()
+
     def __init__(self, system_size: int):
         available_system_sizes = {5, 7, 16, 27, 65, 127, 433}
         if system_size not in available_system_sizes:
-            exit("System size {} not available in IBM's heavyhex devices. Available system sizes are: {}".format(
-                system_size, available_system_sizes))
+            raise ValueError("System size {} not available in IBM's heavyhex devices. Available system sizes are: {}"
+                             .format(system_size, available_system_sizes))
         super().__init__(system_size, "heavyhex")
 
     def get_topology(self):
@@ -67,11 +175,13 @@ class HeavyHexArchitecture(Architecture):
         elif self.system_size == 433:
             return self.get_osprey_topology()
 
-        available_systems = {5: FakeQuitoV2(), 7: FakeLagosV2(), 16: FakeGuadalupeV2(), 27: FakeMumbaiV2(),
-                             127: FakeWashingtonV2()}
-        coupling_list = list(available_systems[self.system_size].coupling_map.get_edges())
-        coupling_list = [list(t) for t in coupling_list]
-        return coupling_list
+        return self.edges_only(self.system_size)
+
+    @classmethod
+    def edges_only(cls, system_size: int):
+        # Fast path for callers that only need the coupling edges of an IBM
+        # device, skipping fake-backend construction entirely.
+        return [list(edge) for edge in _load_heavyhex_coupling(system_size)]
 
     def get_osprey_topology(self):
         coupling_list = []
@@ -98,7 +208,6 @@ class HeavyHexArchitecture(Architecture):
 
             for m in range(*connection_range):
                 intermediate_node = intermediate_nodes[cursor]
-                print(intermediate_node)
                 coupling_list.append([curr_path_nodes[m], intermediate_node])
                 coupling_list.append([intermediate_node, curr_path_nodes[m]])
                 coupling_list.append([prev_path_nodes[m], intermediate_node])
@@ -106,70 +215,72 @@ class HeavyHexArchitecture(Architecture):
                 cursor += 1
             prev_path = curr_path
 
-            if k == 1 or k ==2:
-                G = nx.Graph()
-                G.add_edges_from(coupling_list)
-                #pos = nx.planar_layout(G)
-                pos = nx.nx_agraph.graphviz_layout(G)
-                nx.draw(G, pos=pos)
-                plt.show()
-
-
         # remove two nodes
         coupling_list.remove([25,26])
         coupling_list.remove([no_rows*27, no_rows*27+1])
 
         # make topology symmetric
-        symmetric_edges = []
-        for e in coupling_list:
-            e1, e2 = e
-            symmetric_edges.append([e2, e1])
-        coupling_list.extend(symmetric_edges)
-
-        return coupling_list
-
-    def _get_row(self, row_idx: int, m: int, n: int):
-        row = []
-        # todo: is it symmetric?
-        # 12 * 7 intermediate nodes
-        # 433 -12 * 7 path nodes
-        path = nx.path_graph(27)
-
-
+        edges = np.asarray(coupling_list, dtype=np.int32)
+        return np.vstack([edges, edges[:, ::-1]])
 
     def get_hummingbird_topology(self):
-        coupling_list = []
-        coupling_list.extend(self._create_connectivity_chain(0, 9))
-        coupling_list.extend(self._create_connectivity_chain(13, 23))
-        coupling_list.extend(self._create_connectivity_chain(27, 37))
-        coupling_list.extend(self._create_connectivity_chain(41, 51))
-        coupling_list.extend(self._create_connectivity_chain(55, 64))
+        chains = [self._create_connectivity_chain(0, 9),
+                  self._create_connectivity_chain(13, 23),
+                  self._create_connectivity_chain(27, 37),
+                  self._create_connectivity_chain(41, 51),
+                  self._create_connectivity_chain(55, 64)]
 
         starting_sets = [[0, 10, 13], [15, 24, 29], [27, 38, 41], [43, 52, 56]]
         for s in starting_sets:
             q1, q2, q3 = s
-            coupling_list.extend(self._create_vertical_chain(s))
-            coupling_list.extend(self._create_vertical_chain([q1 + 4, q2 + 1, q3 + 4]))
-            coupling_list.extend(self._create_vertical_chain([q1 + 8, q2 + 2, q3 + 8]))
+            chains.append(self._create_vertical_chain(s))
+            chains.append(self._create_vertical_chain([q1 + 4, q2 + 1, q3 + 4]))
+            chains.append(self._create_vertical_chain([q1 + 8, q2 + 2, q3 + 8]))
 
-        return coupling_list
+        return np.concatenate(chains)
 
     def _create_connectivity_chain(self, begin: int, end: int):
-        chain = []
-        for idx in range(begin, end):
-            chain.append([idx, idx + 1])
-            chain.append([idx + 1, idx])
-        return chain
+        a = np.arange(begin, end, dtype=np.int32)
+        fwd = np.stack([a, a + 1], axis=1)
+        return np.vstack([fwd, fwd[:, ::-1]])
 
     def _create_vertical_chain(self, indices):
-        chain = []
-        for k in range(len(indices) - 1):
-            chain.append([indices[k], indices[k + 1]])
-            chain.append([indices[k + 1], indices[k]])
-        return chain
+        a = np.asarray(indices, dtype=np.int32)
+        fwd = np.stack([a[:-1], a[1:]], axis=1)
+        return np.vstack([fwd, fwd[:, ::-1]])
+
+
+def _build_rigetti_edges(m: int, n: int):
+    # m x n grid of 8-qubit rings, built entirely from index arithmetic:
+    # ring cycles, neighbour connections inside a row, and row-to-row
+    # connections, mirrored once at the end.
+    base = np.arange(m * n, dtype=np.int32)[:, None] * 8
+    i = np.arange(8, dtype=np.int32)
+    rings = np.stack([(base + i).ravel(), (base + (i + 1) % 8).ravel()], axis=1)
+
+    row_offsets = np.arange(m, dtype=np.int32)[:, None] * (n * 8)
+    k = np.arange(1, n, dtype=np.int32)
+    intra = np.concatenate([
+        np.stack([(row_offsets + (k - 1) * 8 + 2).ravel(), (row_offsets + k * 8 + 7).ravel()], axis=1),
+        np.stack([(row_offsets + (k - 1) * 8 + 3).ravel(), (row_offsets + k * 8 + 6).ravel()], axis=1),
+    ]) if n > 1 else np.empty((0, 2), dtype=np.int32)
+
+    row = np.arange(1, m, dtype=np.int32)[:, None]
+    ring = np.arange(n, dtype=np.int32)
+    prev = (ring + row * n) * 8
+    curr = (ring + (row - 1) * n) * 8
+    inter = np.concatenate([
+        np.stack([(prev + 5).ravel(), curr.ravel()], axis=1),
+        np.stack([(prev + 4).ravel(), (curr + 1).ravel()], axis=1),
+    ]) if m > 1 else np.empty((0, 2), dtype=np.int32)
+
+    edges = np.concatenate([rings, intra, inter])
+    return np.vstack([edges, edges[:, ::-1]])
 
 
 class RigettiArchitecture(Architecture):
+    __slots__ = ("m", "n")
+
     def __init__(self, system_size: int, m: int, n: int):
         self.m = m
         self.n = n
@@ -177,48 +288,4 @@ class RigettiArchitecture(Architecture):
         super().__init__(system_size, "rigetti_rings")
 
     def get_topology(self):
-        rows = []
-        for row_idx in range(self.m):
-            row = self._create_row_rings(row_idx)
-            rows.extend(row)
-
-            if row_idx != 0:
-                # connect rows with each other
-                for ring_idx in range(self.n):
-                    prev_node = (ring_idx + row_idx * self.n) * 8
-                    curr_node = (ring_idx + (row_idx - 1) * self.n) * 8
-
-                    rows.append([prev_node + 5, curr_node])
-                    rows.append([curr_node, prev_node + 5])
-
-                    rows.append([prev_node + 4, curr_node + 1])
-                    rows.append([curr_node + 1, prev_node + 4])
-
-        return rows
-
-    def _create_row_rings(self, row_idx: int):
-        row_ring = []
-        for k in range(self.n):
-            # create n rings next to each other
-            ring = []
-            for i in range(8):
-                idx = k * 8 + i
-                if i == 7:
-                    ring.append([idx, idx - 7])
-                    ring.append([idx - 7, idx])
-                else:
-                    ring.append([idx, idx + 1])
-                    ring.append([idx + 1, idx])
-
-            row_ring.extend(ring)
-
-            # append to the latest ring
-            if k != 0:
-                row_ring.append([(k - 1) * 8 + 2, k * 8 + 7])
-                row_ring.append([k * 8 + 7, (k - 1) * 8 + 2])
-
-                row_ring.append([(k - 1) * 8 + 3, k * 8 + 6])
-                row_ring.append([k * 8 + 6, (k - 1) * 8 + 3])
-
-        row_ring = [[row_idx * self.n * 8 + x, row_idx * self.n * 8 + y] for x, y in row_ring]
-        return row_ring
+        return _build_rigetti_edges(self.m, self.n)
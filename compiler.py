@@ -1,23 +1,52 @@
+import hashlib
+import io
+from collections import OrderedDict
 from typing import Union
 
-from qiskit import QuantumCircuit
+from qiskit import QuantumCircuit, qpy
 from qiskit.compiler import transpile
 from qiskit.providers.fake_provider import FakeGuadalupeV2
+from qiskit.transpiler import PassManager
+from qiskit.transpiler.passes import Unroll3qOrMore
 import qiskit
+from joblib import Parallel, delayed
+from tqdm import tqdm
 
 from architectures import Architecture
-from mappings import InitialLayout, QiskitSabreLayout
+from mappings import InitialLayout, QiskitSabreLayout, RandomInitialLayout
+
+# Transpiling is the dominant cost (seconds per call), and sweeps hit identical
+# (circuit, layout, seed) combinations repeatedly. Cache the transpiled circuit
+# together with its gate counts, bounded so long grid searches cannot grow it
+# without limit.
+_transpile_cache = OrderedDict()
+_TRANSPILE_CACHE_SIZE = 256
 
 
 class Compiler:
+    __slots__ = ("arc", "no_qubits", "circ", "coupling_map", "gate_counts", "_circ_key", "_cmap_key")
+
     def __init__(self, arc: Union[qiskit.providers.BackendV2, Architecture], circuit: QuantumCircuit, no_qubits: int):
         self.arc = arc
         self.no_qubits = no_qubits
-        self.circ = circuit
+        # Routing only handles 1- and 2-qubit gates, so every transpile call
+        # would unroll larger gates again; lower the circuit once up front and
+        # reuse it across all compile calls.
+        self.circ = PassManager([Unroll3qOrMore()]).run(circuit)
 
-        self.coupling_map = arc.coupling_map
+        if isinstance(arc, Architecture):
+            self.coupling_map = arc.qiskit_coupling_map
+        else:
+            self.coupling_map = arc.coupling_map
         self.gate_counts = None
 
+        # qpy is much faster than QASM for (parametrized) circuits and, unlike
+        # hash(), blake2b gives a stable key across processes.
+        buf = io.BytesIO()
+        qpy.dump(self.circ, buf)
+        self._circ_key = hashlib.blake2b(buf.getvalue(), digest_size=16).digest()
+        self._cmap_key = tuple(map(tuple, self.coupling_map.get_edges()))
+
     def compile(self, layout_provider: InitialLayout, seed:int = None, opt_level: int = 0):
         layout_method = None
 
@@ -27,8 +56,64 @@ class Compiler:
         else:
             initial_layout = layout_provider.get_virtual_layout()
 
+        # Unseeded transpilation is deliberately stochastic, so only seeded
+        # results are safe to reuse.
+        if seed is None:
+            qc_transpiled = transpile(self.circ, initial_layout=initial_layout, layout_method = layout_method,
+                                      coupling_map=self.coupling_map, optimization_level=opt_level,
+                                      routing_method="sabre", seed_transpiler=seed)
+            self.gate_counts = qc_transpiled.count_ops()
+            return qc_transpiled
+
+        layout_key = layout_method if initial_layout is None else tuple(initial_layout)
+        cache_key = (self._circ_key, layout_key, self._cmap_key, seed, opt_level)
+        cached = _transpile_cache.get(cache_key)
+        if cached is not None:
+            _transpile_cache.move_to_end(cache_key)
+            # Hand back copies so downstream mutation cannot corrupt the cache.
+            self.gate_counts = cached[1].copy()
+            return cached[0].copy()
+
         qc_transpiled = transpile(self.circ, initial_layout=initial_layout, layout_method = layout_method,
                                   coupling_map=self.coupling_map, optimization_level=opt_level, routing_method="sabre", seed_transpiler=seed)
         self.gate_counts = qc_transpiled.count_ops()
-        return qc_transpiled
 
+        _transpile_cache[cache_key] = (qc_transpiled, self.gate_counts.copy())
+        if len(_transpile_cache) > _TRANSPILE_CACHE_SIZE:
+            _transpile_cache.popitem(last=False)
+        # The cache keeps the original object; the caller gets its own copy,
+        # same as on a hit.
+        return qc_transpiled.copy()
+
+
+def _route_with_layout(circuit: QuantumCircuit, layout: list, coupling, seed: int):
+    routed = transpile(circuit, coupling_map=coupling, initial_layout=layout, optimization_level=0,
+                       routing_method="sabre", seed_transpiler=seed)
+    return sum(1 for inst in routed.data if inst.operation.name == "swap")
+
+
+def sweep_random_layouts(arc: Union[qiskit.providers.BackendV2, Architecture], circuit: QuantumCircuit,
+                         no_qubits: int, no_layouts: int = 100, seed: int = None, n_jobs: int = -1):
+    """
+    Transpiles `circuit` under `no_layouts` random initial layouts and collects the swap counts.
+
+    Every iteration is a pure function of (circuit, layout, coupling map), so the sweep fans out
+    over all cores with joblib's loky backend instead of running serially.
+
+    :return: List of (swap_count, virtual_layout) tuples, one per random layout.
+    """
+    if isinstance(arc, Architecture):
+        no_phys_qubits = arc.system_size
+        coupling = arc.coupling_map_list
+    else:
+        # BackendV2 instances expose num_qubits and a ready-made CouplingMap.
+        no_phys_qubits = arc.num_qubits
+        coupling = arc.coupling_map
+
+    layouts = [RandomInitialLayout(no_qubits, no_phys_qubits, seed=s).get_virtual_layout()
+               for s in range(no_layouts)]
+
+    parallel = Parallel(n_jobs=n_jobs, backend="loky")
+    swap_counts = parallel(delayed(_route_with_layout)(circuit, layout, coupling, seed)
+                           for layout in tqdm(layouts))
+    return list(zip(swap_counts, layouts))
@@ -1,12 +1,19 @@
 import copy
+import functools
+import hashlib
+import io
 import itertools
+import math
+import os
 import pickle
+from collections import OrderedDict
 from abc import abstractmethod, ABC
-import random
 
 from typing import Optional, Union
 
+import numpy as np
 import qiskit
+import rustworkx as rx
 from pytket._tket.passes import PlacementPass, NaivePlacementPass, SequencePass
 from pytket._tket.predicates import CompilationUnit
 from pytket.extensions.qiskit import qiskit_to_tk
@@ -15,7 +22,7 @@ from pytket.placement import LinePlacement, GraphPlacement
 from qiskit.providers.fake_provider import FakeGuadalupeV2
 
 from pytket.architecture import Architecture
-from qiskit import QuantumCircuit
+from qiskit import QuantumCircuit, qpy
 from qiskit.transpiler.passes import TrivialLayout
 
 import architectures
@@ -40,6 +47,10 @@ class InitialLayout(ABC):
         self.name = name
         self.virtual_layout = None
         self.physical_layout = None
+        # Virtual->physical and physical->virtual views of the chosen layout;
+        # p2v is a dense array with -1 marking unassigned physical qubits.
+        self.v2p: dict[int, int] = None
+        self.p2v: Optional[np.ndarray] = None
 
     @abstractmethod
     def get_physical_layout(self):
@@ -51,22 +62,39 @@ class InitialLayout(ABC):
 
 class LayoutByExhaustiveSearch(InitialLayout):
 
+    # Bounds the VF2 search so pathological interaction graphs cannot hang the
+    # candidate enumeration; the search falls back to full enumeration instead.
+    VF2_CALL_LIMIT = 10_000_000
+
     def __init__(self, no_virt_qubits: int, no_phys_qubits: int, backend: architectures.Architecture,
-                 qc: QuantumCircuit, method):
+                 qc: QuantumCircuit, method, vf2_pruning: bool = False, stop_on_zero: bool = False):
         '''
         This layout class is responsible for finding the best layout in terms of swap count by exhaustive search.
 
         :param no_virt_qubits: The number of virtual qubits in the quantum circuit.
         :param no_phys_qubits: The number of physical qubits in the QPU.
         :param routing_method: The routing method used to obtain swap gates.
+        :param vf2_pruning: If True, restrict the search to layouts under which every
+            two-qubit gate acts on coupled physical qubits (enumerated by VF2 subgraph
+            isomorphism), falling back to the full factorial search when the interaction
+            graph does not embed. Only sound for best-layout searches: the true worst
+            layout is usually not among the embeddings.
+        :param stop_on_zero: Abort the scan once a swap-free layout turns up; such a
+            layout is optimal by construction. Like vf2_pruning, only sound when the
+            caller is after the best layout.
         '''
 
         super().__init__(no_virt_qubits, no_phys_qubits, method)
-        self.v2p: dict[int, int] = None  # TODO: This should be in super class
-        self.p2v: dict[int, Optional[int]] = None
-        self.qc = qc
+        # The routing scorer (and everything derived from the gate pairs below)
+        # only understands 1- and 2-qubit gates; lower larger ones up front.
+        self.qc = utils.unroll_to_two_qubit_gates(qc)
         self.backend = backend
-        self.coupling = backend.coupling_map
+        self.coupling = backend.coupling_map_list
+        self.vf2_pruning = vf2_pruning
+        self.stop_on_zero = stop_on_zero
+        # Scan the circuit once: every consumer (VF2 pruning, canonicalization,
+        # distance scoring) works off this int32 (m, 2) gate-pair array.
+        self.edges = np.asarray(utils.get_interaction_pairs(self.qc), dtype=np.int32).reshape(-1, 2)
 
         self.result_dict = None
         self.worst_layout = None
@@ -77,49 +105,159 @@ class LayoutByExhaustiveSearch(InitialLayout):
     def get_physical_layout(self):
         pass
 
+    def _device_graph(self):
+        device_graph = rx.PyGraph(multigraph=False)
+        device_graph.add_nodes_from(range(self.no_phys_qubits))
+        device_graph.add_edges_from_no_data([tuple(e) for e in self.coupling])
+        return device_graph
+
+    def _canonical_layouts(self, perms):
+        """
+        Filters a layout stream down to one representative per equivalence class:
+        layouts that only differ in where they put virtual qubits untouched by any
+        two-qubit gate produce identical swap counts (idle qubits never enter the
+        routing front layer) and are evaluated once. Coupling-graph automorphisms are
+        deliberately NOT folded in here: seeded SABRE breaks ties on physical-qubit
+        labels, so automorphic images of a layout can route to different swap counts
+        and collapsing an orbit to one representative corrupts the best/worst bounds.
+        """
+        active = sorted({q for edge in self._get_interaction_edges() for q in edge})
+        inactive = [v for v in range(self.no_virt_qubits) if v not in set(active)]
+        seen = set()
+        for perm in perms:
+            placement = tuple(perm[v] for v in active)
+            if placement in seen:
+                continue
+            seen.add(placement)
+            # Pin the interchangeable inactive qubits to the smallest free
+            # physical slots so their arbitrary positions cannot multiply the
+            # candidate set.
+            used = set(placement)
+            free = (p for p in range(self.no_phys_qubits) if p not in used)
+            layout = list(perm)
+            for v in inactive:
+                layout[v] = next(free)
+            yield tuple(layout)
+
+    def _get_interaction_edges(self):
+        return sorted({(min(a, b), max(a, b)) for a, b in self.edges.tolist()})
+
+    def _vf2_candidate_layouts(self):
+        """
+        Enumerates the layouts under which the circuit's two-qubit interaction graph is a
+        subgraph of the coupling graph (i.e. every gate is directly executable).
+
+        :return: List of layout tuples, or None if no embedding exists and the caller
+            should fall back to enumerating all permutations.
+        """
+        device_graph = self._device_graph()
+
+        interaction_graph = rx.PyGraph(multigraph=False)
+        interaction_graph.add_nodes_from(range(self.no_virt_qubits))
+        interaction_graph.add_edges_from_no_data(self._get_interaction_edges())
+
+        layouts = []
+        for node_map in rx.vf2_mapping(device_graph, interaction_graph, subgraph=True,
+                                       induced=False, call_limit=self.VF2_CALL_LIMIT):
+            layout = [None] * self.no_virt_qubits
+            for phys, virt in node_map.items():
+                layout[virt] = phys
+            used = set(layout)
+            free = (p for p in range(self.no_phys_qubits) if p not in used)
+            layouts.append(tuple(p if p is not None else next(free) for p in layout))
+        return layouts or None
+
+    def _cache_filename(self):
+        """
+        Cache files are keyed by content hashes of the circuit's two-qubit interaction
+        sequence and the coupling map: circuit names collide freely across benchmarks
+        (mqt.bench reuses them), and pruned searches cover a different candidate set
+        than full enumerations, hence the _vf2 suffix.
+        """
+        pairs = utils.get_interaction_pairs(self.qc)
+        qc_hash = hashlib.blake2b(repr(pairs).encode(), digest_size=16).hexdigest()
+        cmap_hash = hashlib.blake2b(repr(sorted(map(tuple, self.coupling))).encode(),
+                                    digest_size=16).hexdigest()
+        return "layout_bins/ExhaustiveSearch_{}_{}_{}_{}{}.npz".format(
+            self.no_phys_qubits, qc_hash, cmap_hash, self.seed,
+            "_vf2" if self.vf2_pruning else "")
+
     def get_virtual_layout(self):
         if self.best_layout is not None and self.worst_layout is not None and self.seed is None:
             return self.best_layout, self.worst_layout
 
-        pickle_data = self.load_from_pickle(self.qc.name, "_" + str(self.seed) + "_" + self.backend.name)
-        if pickle_data is not None:
-            best_perm, worst_perm = utils.find_layout_bounds(pickle_data)
+        filename = self._cache_filename()
+        cached_results = self.load_from_disk(filename)
+        if cached_results is not None:
+            best_perm, worst_perm = utils.find_layout_bounds(cached_results)
             self.best_layout = best_perm
             self.worst_layout = worst_perm
             return self.best_layout, self.worst_layout
 
-        perms = list(itertools.permutations(list(range(self.no_phys_qubits))))
-        result_dict = utils.get_results_dict(perms, self.qc, self.coupling, self.seed)
+        # Resume from the partial flush of an interrupted run, if present.
+        partial_path = filename + ".partial"
+        precomputed = None
+        try:
+            with open(partial_path, "rb") as handle:
+                precomputed = pickle.load(handle)
+            print("Resuming layout search from {} precomputed entries.".format(len(precomputed)))
+        except OSError:
+            pass
+
+        perms = None
+        if self.vf2_pruning:
+            perms = self._vf2_candidate_layouts()
+        if perms is None:
+            # Keep the permutations lazy; materializing them first costs
+            # O(n!/(n-k)! * k) memory before any scoring starts. Only the
+            # no_virt_qubits placements matter for the swap count, so the
+            # unused physical qubits are never permuted.
+            perms = itertools.permutations(range(self.no_phys_qubits), self.no_virt_qubits)
+            total = math.perm(self.no_phys_qubits, self.no_virt_qubits)
+        else:
+            total = len(perms)
+        # Deduplicate symmetry-equivalent candidates before paying for scoring;
+        # `total` stays an upper bound for the progress bar.
+        perms = self._canonical_layouts(perms)
+        result_dict = utils.get_results_dict(perms, self.qc, self.coupling, self.seed, total=total,
+                                             precomputed=precomputed, flush_path=partial_path,
+                                             stop_on_zero=self.stop_on_zero,
+                                             dist_matrix=self.backend.distance_matrix)
         self.result_dict = result_dict
 
         best_perm, worst_perm = utils.find_layout_bounds(self.result_dict)
         self.best_layout = best_perm
         self.worst_layout = worst_perm
-        self.save(result_dict, self.qc.name, "_" + str(self.seed) + "_" + self.backend.name)
+        self.save(result_dict, filename)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
         return self.best_layout, self.worst_layout
 
 
-    def save(self, result_dict, qc_name: str, arc_name: str):
-        filename = "layout_bins/{}_{}_{}_{}.pickle".format("ExhaustiveSearch", self.no_phys_qubits, qc_name, arc_name)
+    def save(self, result_dict, filename: str):
+        # One int16 matrix for the layouts plus one vector for the counts is
+        # ~10x smaller on disk than a pickled tuple-keyed dict, and loading it
+        # skips reconstructing millions of tuple objects.
+        perms_arr = np.asarray(list(result_dict.keys()), dtype=np.int16)
+        swaps_arr = np.fromiter(result_dict.values(), dtype=np.int16, count=len(result_dict))
         with open(filename, 'wb') as handle:
-            pickle.dump(result_dict, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            np.savez_compressed(handle, perms=perms_arr, swaps=swaps_arr)
 
-    def load_from_pickle(self, qc_name: str, arc_name: str):
-        filename = "layout_bins/{}_{}_{}_{}.pickle".format("ExhaustiveSearch", self.no_phys_qubits, qc_name, arc_name)
+    def load_from_disk(self, filename: str):
         try:
-            with open(filename, 'rb') as handle:
-                result_dict = pickle.load(handle)
-                return result_dict
-        except:
+            data = np.load(filename)
+        except OSError:
             print("File {} does not exist. Performing layout search from start.".format(filename))
             return None
+        return data["perms"], data["swaps"]
 
 
 class BestLayout(LayoutByExhaustiveSearch):
 
     def __init__(self, no_virt_qubits: int, no_phys_qubits: int, backend: architectures.Architecture,
                  qc: QuantumCircuit):
-        super().__init__(no_virt_qubits, no_phys_qubits, backend, qc, "BestLayout")
+        super().__init__(no_virt_qubits, no_phys_qubits, backend, qc, "BestLayout", vf2_pruning=True,
+                         stop_on_zero=True)
 
 
     def get_physical_layout(self):
@@ -154,8 +292,9 @@ class RandomInitialLayout(InitialLayout):
         Randomization can be fixed by a seed per initialization.
         """
         self.seed = seed
-        self.v2p: dict[int, int] = None  # TODO: This should be in super class
-        self.p2v: dict[int, Optional[int]] = None
+        # numpy's Generator samples without replacement on preallocated buffers
+        # and, unlike the global random module, is picklable into workers.
+        self._rng = np.random.default_rng(seed)
         super().__init__(no_virt_qubits, no_phys_qubits, "random")
 
 
@@ -168,9 +307,11 @@ class RandomInitialLayout(InitialLayout):
         """
         if self.physical_layout is not None:
             return self.physical_layout
-        else:
-            physical_layout = list[sorted(self.p2v).values()]
-            return physical_layout
+
+        if self.p2v is None:
+            self.get_virtual_layout()
+        self.physical_layout = [int(virt) if virt >= 0 else None for virt in self.p2v]
+        return self.physical_layout
 
     def get_virtual_layout(self) -> list[int]:
         """
@@ -183,23 +324,39 @@ class RandomInitialLayout(InitialLayout):
             return self.virtual_layout
 
         else:
-            if self.seed is not None:
-                random.seed(self.seed)
-            virtual_layout = random.sample(range(self.no_phys_qubits), self.no_virt_qubits)
+            virtual_layout = self._rng.choice(self.no_phys_qubits, self.no_virt_qubits,
+                                              replace=False).tolist()
+            # Cache the draw: the old reseed-per-call pattern only returned a
+            # stable layout by accident of reseeding global state.
+            self.virtual_layout = virtual_layout
             self.v2p = dict(zip(range(self.no_virt_qubits), virtual_layout))
             self.p2v = self._set_p2v_from_v2p()
             return virtual_layout
 
-    def _set_p2v_from_v2p(self) -> dict[int, Optional[int]]:
-        p2v = dict()
-        for key_v in self.v2p:
-            p2v[self.v2p[key_v]] = key_v
+    def _set_p2v_from_v2p(self) -> np.ndarray:
+        # Dense array indexed by physical qubit, -1 marking unassigned slots;
+        # one vectorized scatter instead of rebuilding a dict in a Python loop.
+        p2v = np.full(self.no_phys_qubits, -1, dtype=np.int32)
+        phys = np.fromiter(self.v2p.values(), dtype=np.int32, count=len(self.v2p))
+        virt = np.fromiter(self.v2p.keys(), dtype=np.int32, count=len(self.v2p))
+        p2v[phys] = virt
+        return p2v
 
-        for idx in range(self.no_phys_qubits):
-            if idx not in p2v:
-                p2v[idx] = None
+    @classmethod
+    def sample_many(cls, no_phys_qubits: int, no_virt_qubits: int, no_layouts: int,
+                    seed: int = None) -> np.ndarray:
+        """
+        Draws `no_layouts` random layouts in one vectorized call for batched sweeps.
 
-        return p2v
+        Row-wise argsort of an iid uniform matrix yields a uniform random permutation
+        per row; truncating to no_virt_qubits columns gives the same distribution as
+        repeated random.sample at C speed.
+
+        :return: int32 array of shape (no_layouts, no_virt_qubits).
+        """
+        rng = np.random.default_rng(seed)
+        scores = rng.random((no_layouts, no_phys_qubits))
+        return scores.argsort(axis=1)[:, :no_virt_qubits].astype(np.int32)
 
     def set_layout_from_physical_qubits(self, permutation: list[Optional[int]]):
         assert len(permutation) == self.no_phys_qubits
@@ -212,6 +369,47 @@ class RandomInitialLayout(InitialLayout):
 
 ######################## Tket's Initial Layouts ########################
 
+# Sweeps hand the same QuantumCircuit (or equal copies rebuilt per
+# architecture) to many placement providers; converting to tket per provider
+# is wasted work. An identity-keyed table memoizes each instance's content
+# digest (the entry keeps the circuit alive, so ids cannot be recycled
+# underneath us), and conversions are shared at content granularity so equal
+# circuits from different construction sites hit the same entry. Both caches
+# are bounded: unbounded ones can end up hurting more than they help.
+_tket_digest_cache = OrderedDict()
+_tket_conversion_cache = OrderedDict()
+_TKET_CIRCUIT_CACHE_SIZE = 128
+_TKET_CONVERSION_CACHE_SIZE = 64
+
+
+def _cached_qiskit_to_tk(qc):
+    entry = _tket_digest_cache.get(id(qc))
+    if entry is None or entry[0] is not qc:
+        buf = io.BytesIO()
+        qpy.dump(qc, buf)
+        entry = (qc, hashlib.blake2b(buf.getvalue(), digest_size=16).digest())
+        _tket_digest_cache[id(qc)] = entry
+        if len(_tket_digest_cache) > _TKET_CIRCUIT_CACHE_SIZE:
+            _tket_digest_cache.popitem(last=False)
+
+    digest = entry[1]
+    tket_qc = _tket_conversion_cache.get(digest)
+    if tket_qc is None:
+        tket_qc = qiskit_to_tk(qc)
+        _tket_conversion_cache[digest] = tket_qc
+        if len(_tket_conversion_cache) > _TKET_CONVERSION_CACHE_SIZE:
+            _tket_conversion_cache.popitem(last=False)
+    else:
+        _tket_conversion_cache.move_to_end(digest)
+    return tket_qc
+
+
+@functools.lru_cache(maxsize=128)
+def _tket_architecture(coupling_key):
+    # One tket Architecture per distinct coupling map, shared across providers.
+    return Architecture(connections=[list(edge) for edge in coupling_key])
+
+
 class TketPlacementLayout(InitialLayout):
     def __init__(self, no_virt_qubits: int, no_phys_qubits: int, method: str,
                  backend: Union[qiskit.providers.BackendV2, Architecture] = None,
@@ -220,18 +418,12 @@ class TketPlacementLayout(InitialLayout):
         """
         TketPlacementLayout is an abstract class for Tket-specific placements.
         """
-        self.v2p: dict[int, int] = None
-        self.p2v: dict[int, Optional[int]] = None
         self.backend = backend
         self.qc = qc
-        self.tket_qc = qiskit_to_tk(self.qc)
+        self.tket_qc = _cached_qiskit_to_tk(self.qc)
         self.kwargs = kwargs
-
-        self.v2p: dict[int, int] = None
-        self.p2v: dict[int, Optional[int]] = None
         self.method = method
-        self.arc = Architecture(
-            connections=self.backend.coupling_map)
+        self.arc = _tket_architecture(tuple(map(tuple, self.backend.coupling_map_list)))
         # TODO: Generalize to other arcs too. When using qiskit,
         # this becomes list(self.backend.coupling_map.get_edges()). The class should only receive couplings.
 
@@ -252,7 +444,10 @@ class TketPlacementLayout(InitialLayout):
 
         naive_placement_pass = NaivePlacementPass(self.arc)
 
-        cu = CompilationUnit(self.tket_qc)
+        # Circuit.copy() is a C++-level clone (deepcopy would walk every gate
+        # through the pickle protocol); it keeps the cached conversion shared
+        # across providers safe from whatever the passes do to the unit.
+        cu = CompilationUnit(self.tket_qc.copy())
 
         # Apply a placement method first and then initialize the unlabeled qubits with naive approach.
         seq_pass = SequencePass([initial_placement_pass, naive_placement_pass])
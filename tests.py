@@ -1,11 +1,17 @@
+import hashlib
+import io
+import json
 import pickle
-import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 from typing import List
 
 import seaborn as sns
-import numpy as np
+import zstandard as zstd
+import pandas as pd
 from matplotlib import pyplot as plt
-from mqt.bench import get_benchmark
+from qiskit import qpy
 
 import architectures
 import utils
@@ -15,40 +21,181 @@ from mappings import LinePlacementLayout, GraphPlacementLayout, BestLayout, Layo
 
 import os.path
 
+# Plotting only ever needs swap and depth counts, but the pipeline used to
+# unpickle every full transpiled circuit to recover those two integers. The
+# metrics sidecar stores them keyed by the artifact stem, with a hash of the
+# source circuit recorded for integrity.
+METRICS_FILE = "transpiled_qc_bins/metrics.json"
 
-def calculate_results(layouts, alg, arcs:List[architectures.Architecture], max_seed):
+
+def _load_metrics():
+    # A torn sidecar must never wedge the pipeline: treat unreadable or
+    # corrupt JSON as an empty store (the entries are re-derived from the
+    # artifacts or recompiled).
+    try:
+        with open(METRICS_FILE) as handle:
+            return json.load(handle)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _store_metrics(metrics):
+    # tmp-file + rename, like _dump_artifact: the sidecar is rewritten in
+    # place many times per run, and a crash mid-write must not leave a torn
+    # file behind.
+    path = Path(METRICS_FILE)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as handle:
+        json.dump(metrics, handle)
+    tmp_path.replace(path)
+
+
+def _circuit_metrics(qc_transpiled):
+    # One pass over the instructions instead of the dict count_ops rebuilds.
+    swap_count = sum(1 for inst in qc_transpiled.data if inst.operation.name == "swap")
+    return {"swap": swap_count, "depth": qc_transpiled.depth()}
+
+
+def _result_stem(lay_name, system_size, circ_name, arc_name, seed):
+    return "{}_{}_{}_{}_{}".format(lay_name, system_size, circ_name, arc_name, seed)
+
+
+# Benchmark construction is identical for every layout (and for every arch of
+# the same size), so build each (alg, size) once and hand out copies to keep
+# caller mutations isolated.
+_circuit_cache = {}
+
+
+def _build_circuit(alg, system_size):
+    key = (alg, system_size)
+    circ = _circuit_cache.get(key)
+    if circ is None:
+        if alg == "qaoa":
+            circ = utils.get_qaoa_circuit(system_size)
+        elif alg == "vqe":
+            circ = utils.get_vqe_circuit(system_size)
+        else:
+            circ = utils.cached_get_benchmark(alg, "indep", system_size)
+
+        circ = circ.copy()
+        circ.remove_final_measurements()
+        _circuit_cache[key] = circ
+    return circ.copy()
+
+
+def _dump_artifact(stem, qc_transpiled):
+    # qpy's binary encoder skips the recursive object walk that pickling a
+    # QuantumCircuit pays; zstd level 3 is nearly free on CPU and cuts the
+    # bytes a further 3-5x. The tmp-file + rename makes the write atomic, so
+    # an interrupted run never leaves a torn artifact that later passes the
+    # existence check.
+    path = Path("transpiled_qc_bins") / "{}.qpy.zst".format(stem)
+    tmp_path = path.with_name(path.name + ".tmp")
+    compressor = zstd.ZstdCompressor(level=3)
+    with open(tmp_path, "wb") as handle, compressor.stream_writer(handle) as writer:
+        qpy.dump(qc_transpiled, writer)
+    tmp_path.replace(path)
+
+
+def _load_artifact(stem):
+    try:
+        with open("transpiled_qc_bins/{}.qpy.zst".format(stem), "rb") as handle, \
+                zstd.ZstdDecompressor().stream_reader(handle) as reader:
+            # qpy.load seeks, which the decompression stream cannot; inflate
+            # into memory first (artifacts are small once compressed).
+            buffer = io.BytesIO(reader.read())
+        return qpy.load(buffer)[0]
+    except FileNotFoundError:
+        pass
+    # Artifacts from before compression / the qpy switch.
+    try:
+        with open("transpiled_qc_bins/{}.qpy".format(stem), "rb") as handle:
+            return qpy.load(handle)[0]
+    except FileNotFoundError:
+        with open("transpiled_qc_bins/{}.pickle".format(stem), "rb") as handle:
+            return pickle.load(handle)
+
+
+def _compile_one(task):
+    # Workers receive the circuit as qpy bytes and rebuild the Compiler and
+    # layout provider themselves; shipping the constructed providers would drag
+    # along unpicklable backend state.
+    lay, arc, circ_bytes, seed = task
+    circ = qpy.load(io.BytesIO(circ_bytes))[0]
+    compiler = Compiler(arc, circ, arc.system_size)
+    l = lay(arc.system_size, arc.system_size, arc, circ)
+    qc_transpiled = compiler.compile(l, seed=seed)
+    stem = _result_stem(l.name, arc.system_size, circ.name, arc.name, seed)
+    _dump_artifact(stem, qc_transpiled)
+    return stem, dict(_circuit_metrics(qc_transpiled), circ_sha256=hashlib.sha256(circ_bytes).hexdigest())
+
+
+def calculate_results(layouts, alg, arcs:List[architectures.Architecture], max_seed, max_workers=None):
+    metrics = _load_metrics()
+    # One directory read instead of a stat() syscall per (layout, arch, seed);
+    # sweeps over large archs probe thousands of cache entries.
+    try:
+        existing = {entry.name for entry in os.scandir("transpiled_qc_bins")}
+    except OSError:
+        existing = set()
+    tasks = []
     for lay in layouts:
         for arc in arcs:
-            # Construct the circuit
-            if alg == "qaoa":
-                circ = utils.get_qaoa_circuit(arc.system_size)
-            elif alg == "vqe":
-                circ = utils.get_vqe_circuit(arc.system_size)
-            else:
-                circ = get_benchmark(alg, "indep", arc.system_size)
-
-            circ.remove_final_measurements()
+            circ = _build_circuit(alg, arc.system_size)
 
             compiler = Compiler(arc, circ, arc.system_size)
             l = lay(arc.system_size, arc.system_size, arc, circ)
 
+            # qpy serializes parametrized circuits that qasm() rejects.
+            buf = io.BytesIO()
+            qpy.dump(circ, buf)
+            circ_bytes = buf.getvalue()
+            circ_sha = hashlib.sha256(circ_bytes).hexdigest()
+
             for s in range(max_seed):
-                # Route the circuit and get results
+                stem = _result_stem(l.name, arc.system_size, circ.name, arc.name, s)
+                # Skip cached seeds before dispatch so workers are never paid
+                # for work that is already on disk.
+                if stem in metrics and (stem + ".qpy.zst" in existing or stem + ".qpy" in existing):
+                    print("Using already compiled circuit for backend {} with layout {} and system size {} for seed {}."
+                          .format(arc.name, l.name, arc.system_size, s))
+                    continue
+
+                print("Compiling backend {} with layout {} and system size {} for seed {}.".format(arc.name, l.name,
+                                                                                       arc.system_size, s))
                 if isinstance(l, LayoutByExhaustiveSearch):
+                    # Exhaustive searches fan out their own worker pool; run
+                    # them in the parent instead of nesting pools.
                     l.seed = s
-                filename = "transpiled_qc_bins/{}_{}_{}_{}_{}.pickle".format(l.name, arc.system_size, circ.name, arc.name,
-                                                                             s)
-                if not os.path.isfile(filename):
-                    print("Compiling backend {} with layout {} and system size {} for seed {}.".format(arc.name, l.name,
-                                                                                           arc.system_size, s))
                     qc_transpiled = compiler.compile(l, seed=s)
-                    pickle.dump(qc_transpiled, open(filename, "wb"))
+                    _dump_artifact(stem, qc_transpiled)
+                    metrics[stem] = dict(_circuit_metrics(qc_transpiled), circ_sha256=circ_sha)
+                    _store_metrics(metrics)
                 else:
-                    print("Using already compiled circuit for backend {} with layout {} and system size {} for seed {}."
-                          .format(arc.name, l.name, arc.system_size, s))
+                    tasks.append((lay, arc, circ_bytes, s))
+
+    if tasks:
+        # Every remaining task is independent (distinct stem), so fan out
+        # across cores.
+        # Spawned workers for the same reason as utils.get_results_dict: the
+        # parent has usually run SABRE already, and forked children inherit a
+        # deadlocked rayon pool.
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            for stem, record in executor.map(_compile_one, tasks):
+                metrics[stem] = record
 
+    _store_metrics(metrics)
+    # Hand the metrics straight back so a calculate -> load -> plot pipeline
+    # never round-trips through the sidecar (let alone the circuit artifacts)
+    # on a cold run.
+    return metrics
 
-def load_results(layouts: List[str], alg: str, arcs:List[architectures.Architecture], max_seed: int):
+
+def load_results(layouts: List[str], alg: str, arcs:List[architectures.Architecture], max_seed: int,
+                 metrics=None):
+    if metrics is None:
+        metrics = _load_metrics()
     result_dict = {}
     for lay in layouts:
         result_dict[lay] = dict()
@@ -57,24 +204,20 @@ def load_results(layouts: List[str], alg: str, arcs:List[architectures.Architect
             swap_results = []
             depth_results = []
             for s in range(max_seed):
-                filename = "transpiled_qc_bins/{}_{}_{}_{}_{}.pickle".format(lay, arc.system_size, alg,
-                                                                         arc.name, s)
-
-                # Load the transpiled circuit if it exists, exit otherwise
-                try:
-                    with open(filename, 'rb') as handle:
-                        transpiled_qc = pickle.load(handle)
-                except:
-                    print("File {} does not exist!".format(filename))
-
-                depth_count = transpiled_qc.depth()
-                if "swap" in transpiled_qc.count_ops():
-                    swap_count = transpiled_qc.count_ops()["swap"]
-                else:
-                    swap_count = 0
+                stem = _result_stem(lay, arc.system_size, alg, arc.name, s)
+                record = metrics.get(stem)
+                if record is None:
+                    # Runs from before the sidecar existed only left the circuit
+                    # artifact behind; recover the two metrics from it once.
+                    try:
+                        transpiled_qc = _load_artifact(stem)
+                    except OSError:
+                        print("File {} does not exist!".format(stem))
+                        continue
+                    record = _circuit_metrics(transpiled_qc)
 
-                swap_results.append(swap_count)
-                depth_results.append(depth_count)
+                swap_results.append(record["swap"])
+                depth_results.append(record["depth"])
 
             if lay == "WorstLayout":
                 result_dict[lay][alg][arc.system_size] = {"swap": max(swap_results), "depth": max(depth_results)}
@@ -87,36 +230,56 @@ def load_results(layouts: List[str], alg: str, arcs:List[architectures.Architect
     return result_dict
 
 
-def plot_results(result_dict: dict, layouts: List[str], arcs: List[architectures.Architecture], benchmark_entity: str, alg:str):
+def results_dataframe(layouts: List[str], alg: str, arcs: List[architectures.Architecture], max_seed: int,
+                      metrics=None):
+    """
+    Long-form metrics table with one row per (layout, alg, size, seed). The layout
+    and algorithm columns are categoricals, so the repeated strings are stored as
+    small integer codes and groupby reductions run vectorized.
+    """
+    if metrics is None:
+        metrics = _load_metrics()
+    rows = []
+    for lay in layouts:
+        for arc in arcs:
+            for s in range(max_seed):
+                record = metrics.get(_result_stem(lay, arc.system_size, alg, arc.name, s))
+                if record is None:
+                    print("No metrics for {} on {} (size {}, seed {})!".format(lay, arc.name,
+                                                                               arc.system_size, s))
+                    continue
+                rows.append((lay, alg, arc.system_size, s, record["swap"], record["depth"]))
+
+    frame = pd.DataFrame.from_records(rows, columns=["lay", "alg", "size", "seed", "swap", "depth"])
+    frame["lay"] = frame["lay"].astype("category")
+    frame["alg"] = frame["alg"].astype("category")
+    return frame
+
+
+def plot_results(frame: pd.DataFrame, layouts: List[str], arcs: List[architectures.Architecture], benchmark_entity: str, alg:str):
     styling = {"color":{"LinePlacement":"darkkhaki", "GraphPlacement":"palevioletred", "TrivialLayout": "cornflowerblue", "SabreLayout":"lightseagreen"},
                "linestyle": {"LinePlacement":"dashed", "GraphPlacement":"dashdot", "TrivialLayout": "-", "SabreLayout":"dotted"}
     }
-    plot_dict = {}
-    for lay in layouts:
-        plot_dict[lay] = []
-        x_arr = [arc.system_size for arc in sorted(arcs, key=lambda x: x.system_size)]
-        # TODO: Find a better way to sort
-        for arc in sorted(arcs, key=lambda x: x.system_size):
-            #plot_dict[lay].append(result_dict[lay][alg][arc.system_size])
-            r = result_dict[lay][alg][arc.system_size][benchmark_entity]
-            min_val = min(r)
-            max_val = max(r)
-            avg_val = statistics.fmean(r)
-            r_tuple = (min_val, avg_val, max_val)
-            plot_dict[lay].append(r_tuple)
+    # One vectorized groupby replaces the hand-rolled nested-dict reductions.
+    agg = frame.groupby(["lay", "size"], observed=True)[benchmark_entity].agg(["min", "mean", "max"]).reset_index()
+    for lay, group in agg.groupby("lay", observed=True):
+        group = group.sort_values("size")
+        # The exhaustive bounds are the extreme seeds, not the seed average.
+        if lay == "BestLayout":
+            y = group["min"]
+        elif lay == "WorstLayout":
+            y = group["max"]
+        else:
+            y = group["mean"]
 
         # plot the average values
-        plt.scatter(x_arr, [t[1] for t in plot_dict[lay]], marker="o", color=styling["color"][lay])
+        plt.scatter(group["size"], y, marker="o", color=styling["color"].get(lay))
 
         # plot the deviation ranges
         if lay not in ["WorstLayout", "BestLayout"]:
-            lower = [t[0] for t in plot_dict[lay]]
-            upper = [t[2] for t in plot_dict[lay]]
-            middle = [t[1] for t in plot_dict[lay]]
-            y_l = np.array(middle) - np.array(lower)
-            y_u = np.array(upper) - np.array(middle)
-            errors = [y_l, y_u]
-            plt.errorbar(x_arr, y= middle, yerr=errors, color=styling["color"][lay], linestyle=styling["linestyle"][lay], label=lay)
+            plt.errorbar(group["size"], y=group["mean"],
+                         yerr=[group["mean"] - group["min"], group["max"] - group["mean"]],
+                         color=styling["color"].get(lay), linestyle=styling["linestyle"].get(lay), label=lay)
 
     plt.grid()
     plt.legend()
@@ -130,7 +293,11 @@ def plot_results(result_dict: dict, layouts: List[str], arcs: List[architectures
 def get_heavyhex_arcs(system_sizes : List[int]):
     arcs = []
     for size in system_sizes:
-        arcs.append(architectures.HeavyHexArchitecture(size))
+        # One bad size should not kill a sweep that has cached work behind it.
+        try:
+            arcs.append(architectures.HeavyHexArchitecture(size))
+        except ValueError as e:
+            print(e)
     return arcs
 
 def get_rigetti_arcs():
@@ -167,6 +334,6 @@ if __name__ == "__main__":
     algorithm = "vqe"
     max_seed = 10
     entity = "swap"
-    calculate_results(layouts.values(), algorithm, archs, max_seed=max_seed)
-    result_dict = load_results(layouts.keys(), algorithm, archs, max_seed=max_seed)
-    plot_results(result_dict, layouts.keys(), archs, entity, algorithm)
\ No newline at end of file
+    metrics = calculate_results(layouts.values(), algorithm, archs, max_seed=max_seed)
+    frame = results_dataframe(layouts.keys(), algorithm, archs, max_seed=max_seed, metrics=metrics)
+    plot_results(frame, layouts.keys(), archs, entity, algorithm)
\ No newline at end of file
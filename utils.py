@@ -1,37 +1,414 @@
+import atexit
+import functools
+import hashlib
+import io
+import itertools
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+import pickle
 import random
 
 import numpy as np
-from joblib import Parallel, delayed
 from mqt.bench.utils import get_examplary_max_cut_qp
-from qiskit import transpile
+from qiskit import qpy
 from qiskit.algorithms.minimum_eigensolvers import QAOA
 from qiskit.algorithms.optimizers import SLSQP
 from qiskit.circuit.library import RealAmplitudes
 from qiskit.primitives import Sampler
 from tqdm import tqdm
 
-def get_results_dict(perms, qc, coupling, seed):
+def get_interaction_pairs(qc):
+    """Virtual qubit pairs of the circuit's two-qubit gates, in gate order."""
+    return [(qc.find_bit(g.qubits[0]).index, qc.find_bit(g.qubits[1]).index)
+            for g in qc.data if len(g.qubits) == 2]
 
-    inputs = [(perm, qc, coupling) for perm in perms]
 
-    def func(inp):
-        perm, qc, coupling = inp
-        r = transpile(qc, coupling_map=coupling, initial_layout=perm, optimization_level=0,
-                      routing_method="sabre", seed_transpiler=seed).count_ops()
-        if "swap" in r:
-            swap_count = r["swap"]
-        else:
-            swap_count = 0
-        return swap_count
+def unroll_to_two_qubit_gates(qc):
+    """
+    Lowers >2-qubit gates the way transpile does before routing. SabreSwap passes
+    larger gates through silently unrouted, so scoring (or deriving interaction
+    edges from) a circuit with a ccx/mcx still in it would just ignore those gates.
+    """
+    if all(len(g.qubits) <= 2 for g in qc.data):
+        return qc
+    from qiskit.transpiler import PassManager
+    from qiskit.transpiler.passes import Unroll3qOrMore
+    return PassManager([Unroll3qOrMore()]).run(qc)
 
-    parallel = Parallel(n_jobs=8)
-    outputs = parallel(delayed(func)(inp) for inp in tqdm(inputs))
-    result_dict = dict(zip([inp[0] for inp in inputs], outputs))
+
+# Read-only state installed once per scoring worker by _init_score_worker, so
+# each task only ships a small (permutation, seed) tuple instead of repickling
+# the circuit and coupling map.
+_score_qc = None
+_score_cmap = None
+
+
+def _init_score_worker(qc_bytes, shm_name, edge_shape, dist_matrix=None):
+    global _score_qc, _score_cmap
+    from multiprocessing import shared_memory
+    from qiskit import qpy
+    from qiskit.transpiler import CouplingMap
+    _score_qc = qpy.load(io.BytesIO(qc_bytes))[0]
+    # The edge list lives in one shared-memory block written by the parent;
+    # workers attach by name instead of each receiving a pickled copy.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        edges = np.ndarray(edge_shape, dtype=np.int16, buffer=shm.buf)
+        _score_cmap = CouplingMap(edges.tolist())
+    finally:
+        shm.close()
+    if dist_matrix is not None:
+        # Pre-seed the all-pairs distances (Architecture.distance_matrix) so
+        # SABRE's first routing pass in this worker skips the O(V*E) BFS.
+        _score_cmap._dist_matrix = np.asarray(dist_matrix, dtype=float)
+
+
+def _score_permutations(task):
+    # Only the routing pass determines the swap count; running the full
+    # transpile pipeline (basis translation, analysis, ...) per permutation
+    # is orders of magnitude more work than needed. A worker scores a whole
+    # chunk per call, sharing the pass instances (SabreSwap's neighbor-table
+    # build in particular) across every layout in the chunk; only SetLayout
+    # differs per candidate.
+    perms, seed = task
+    from qiskit.transpiler import PassManager
+    from qiskit.transpiler.passes import (SetLayout, FullAncillaAllocation, EnlargeWithAncilla,
+                                          ApplyLayout, SabreSwap)
+    allocate = FullAncillaAllocation(_score_cmap)
+    enlarge = EnlargeWithAncilla()
+    apply_layout = ApplyLayout()
+    # trials is pinned to the value the transpile(optimization_level=0) path
+    # uses: the default is the host's CPU count, which would make the cached
+    # scores machine-dependent and rank layouts differently than
+    # Compiler.compile later reports for them.
+    sabre = SabreSwap(_score_cmap, heuristic="basic", seed=seed, trials=5)
+
+    counts = []
+    for perm in perms:
+        routed = PassManager([SetLayout([int(q) for q in perm]), allocate, enlarge, apply_layout,
+                              sabre]).run(_score_qc)
+        # count_ops builds a fresh dict over every instruction; a single pass
+        # counting just the swaps is all this loop needs.
+        counts.append(sum(1 for inst in routed.data if inst.operation.name == "swap"))
+    return counts
+
+
+# Spawning workers costs around a second; per-seed searches over the same
+# circuit and coupling map reuse one persistent pool instead of paying that
+# per call (the seed travels with each task, so it is not part of the key).
+_score_pool = None
+_score_pool_key = None
+_score_shm = None
+
+
+def _get_score_pool(qc_bytes, coupling, dist_matrix=None):
+    global _score_pool, _score_pool_key, _score_shm
+    key = (hashlib.blake2b(qc_bytes, digest_size=16).digest(), tuple(map(tuple, coupling)))
+    if _score_pool is None or _score_pool_key != key:
+        _shutdown_score_pool()
+        # One shared-memory copy of the edge list serves every worker.
+        edge_arr = np.asarray(list(coupling), dtype=np.int16)
+        _score_shm = shared_memory.SharedMemory(create=True, size=edge_arr.nbytes)
+        np.ndarray(edge_arr.shape, dtype=np.int16, buffer=_score_shm.buf)[:] = edge_arr
+        # Spawned (not forked) workers: SABRE's Rust routing spins up a rayon
+        # thread pool, and a child forked after the parent has transpiled
+        # inherits its poisoned state and deadlocks on the first routing pass.
+        _score_pool = multiprocessing.get_context("spawn").Pool(
+            processes=8, initializer=_init_score_worker,
+            initargs=(qc_bytes, _score_shm.name, edge_arr.shape, dist_matrix))
+        _score_pool_key = key
+    return _score_pool
+
+
+def _shutdown_score_pool():
+    global _score_pool, _score_pool_key, _score_shm
+    if _score_pool is not None:
+        _score_pool.terminate()
+        _score_pool = None
+        _score_pool_key = None
+    if _score_shm is not None:
+        _score_shm.close()
+        _score_shm.unlink()
+        _score_shm = None
+
+
+atexit.register(_shutdown_score_pool)
+
+
+def mapped_distance_cost(perm, edges, dist):
+    """
+    Heuristic routing cost of a layout: the sum over two-qubit gates of the coupling
+    distance between their mapped operands, minus one each. Zero iff every gate acts
+    on adjacent physical qubits; cheap enough (one fancy-indexed reduction) to rank
+    millions of candidates before paying for a real routing pass.
+
+    :param perm: Integer array mapping virtual qubit -> physical qubit.
+    :param edges: int32 (m, 2) array of virtual gate pairs (LayoutByExhaustiveSearch.edges).
+    :param dist: All-pairs distance matrix of the device (Architecture.distance_matrix).
+    """
+    if len(edges) == 0:
+        return 0
+    perm = np.asarray(perm)
+    return int((dist[perm[edges[:, 0]], perm[edges[:, 1]]] - 1).sum())
+
+
+def iter_perm_batches(perms, no_qubits, batch_size=100000):
+    """
+    Converts a lazy permutation stream into int16 (<=batch_size, no_qubits) matrices,
+    sized so a batch plus the distance matrix stays cache-resident during scoring.
+    """
+    while True:
+        flat = np.fromiter(itertools.chain.from_iterable(itertools.islice(perms, batch_size)),
+                           dtype=np.int16)
+        if flat.size == 0:
+            return
+        yield flat.reshape(-1, no_qubits)
+
+
+def mapped_distance_cost_batch(perms, edges, dist):
+    """
+    mapped_distance_cost over a whole batch at once: one gather per edge column and a
+    row-wise reduction, so the per-candidate cost is a few nanoseconds instead of a
+    Python call.
+
+    :param perms: Integer array of shape (batch, no_virt_qubits).
+    :return: int32 array of per-layout heuristic costs.
+    """
+    perms = np.asarray(perms)
+    if len(edges) == 0:
+        return np.zeros(len(perms), dtype=np.int32)
+    src = perms[:, edges[:, 0]]
+    dst = perms[:, edges[:, 1]]
+    return (dist[src, dst].astype(np.int32) - 1).sum(axis=1)
+
+
+def coupling_bitmask(coupling, no_qubits):
+    """
+    Packed adjacency for devices of at most 64 qubits: bit v of adj[u] is set iff
+    (u, v) is a coupling edge, so an edge test is one shift and one AND.
+    """
+    if no_qubits > 64:
+        raise ValueError("Bitmask adjacency only supports up to 64 qubits, got {}.".format(no_qubits))
+    adj = np.zeros(no_qubits, dtype=np.uint64)
+    one = np.uint64(1)
+    for u, v in coupling:
+        adj[u] |= one << np.uint64(v)
+        adj[v] |= one << np.uint64(u)
+    return adj
+
+
+def executable_mask(perms, edges, adj):
+    """
+    Boolean mask over a layout batch marking the candidates whose every two-qubit
+    gate lands on a coupling edge - the only layouts that can route swap-free.
+    Testing the packed adjacency costs a couple of instructions per mapped edge,
+    so the expensive scorer can skip the (typically >90%) candidates that already
+    fail on some gate.
+    """
+    perms = np.asarray(perms)
+    if len(edges) == 0:
+        return np.ones(len(perms), dtype=bool)
+    bits = (adj[perms[:, edges[:, 0]]] >> perms[:, edges[:, 1]].astype(np.uint64)) & np.uint64(1)
+    return bits.all(axis=1)
+
+
+def enumerate_executable_perms(no_phys_qubits, no_virt_qubits, edges, adj, batch_size=100000):
+    """
+    Streams int16 matrices of the k-permutations under which every mapped gate pair
+    is a coupling edge. Generation runs through iter_perm_batches (one fromiter per
+    batch instead of tuple-at-a-time Python) and the packed-adjacency mask discards
+    the non-executable candidates batch-wise, so the per-candidate cost stays at
+    C speed end to end.
+
+    :param edges: int32 (m, 2) gate-pair array (LayoutByExhaustiveSearch.edges).
+    :param adj: Packed adjacency from coupling_bitmask.
+    """
+    perms = itertools.permutations(range(no_phys_qubits), no_virt_qubits)
+    for batch in iter_perm_batches(perms, no_virt_qubits, batch_size):
+        mask = executable_mask(batch, edges, adj)
+        if mask.any():
+            yield batch[mask]
+
+
+def monomorphism_layouts(qc, coupling):
+    """
+    Layouts under which the circuit's two-qubit interaction graph is a subgraph of
+    the coupling graph, i.e. every gate is directly executable. Returns None when no
+    embedding exists and the caller should keep its full permutation set.
+    """
+    import networkx as nx
+    qc = unroll_to_two_qubit_gates(qc)
+    no_phys = int(max(max(edge) for edge in coupling)) + 1
+    circuit_graph = nx.Graph()
+    circuit_graph.add_nodes_from(range(qc.num_qubits))
+    circuit_graph.add_edges_from(get_interaction_pairs(qc))
+    device_graph = nx.Graph()
+    device_graph.add_nodes_from(range(no_phys))
+    device_graph.add_edges_from(map(tuple, coupling))
+
+    matcher = nx.algorithms.isomorphism.GraphMatcher(device_graph, circuit_graph)
+    layouts = []
+    for mapping in matcher.subgraph_monomorphisms_iter():
+        layout = [None] * qc.num_qubits
+        for phys, virt in mapping.items():
+            layout[virt] = phys
+        used = set(layout)
+        free = (p for p in range(no_phys) if p not in used)
+        layouts.append(tuple(p if p is not None else next(free) for p in layout))
+    return layouts or None
+
+
+def get_results_dict(perms, qc, coupling, seed, total=None, precomputed=None,
+                     flush_path=None, flush_every=10000, stop_on_zero=False,
+                     monomorphism_prefilter=False, dist_matrix=None):
+    """
+    Scores every permutation in `perms` by its SABRE swap count.
+
+    :param precomputed: Optional {permutation: swap_count} dict (e.g. from an
+        interrupted run) whose entries are reused instead of re-scored.
+    :param flush_path: If given, partial results are pickled there every
+        `flush_every` completed evaluations so an interrupted run can resume.
+    :param stop_on_zero: Stop scoring as soon as a swap-free layout is seen; it
+        is the global optimum by construction, so best-only searches gain
+        nothing from the rest of the space. The returned dict then only covers
+        the candidates scored so far.
+    :param monomorphism_prefilter: Replace `perms` with the edge-preserving
+        embeddings of the interaction graph when any exist (falling back to the
+        given permutations otherwise). Only sound for best-layout searches;
+        worst-layout scans need the full space.
+    :param dist_matrix: Precomputed all-pairs coupling distances
+        (Architecture.distance_matrix); forwarded to the workers so routing
+        does not redo the BFS per worker.
+    """
+    # Routing-only scoring is blind to >2q gates; lower them first so the
+    # mapped-edge signatures and the workers both see what SABRE will route.
+    qc = unroll_to_two_qubit_gates(qc)
+
+    if monomorphism_prefilter:
+        candidates = monomorphism_layouts(qc, coupling)
+        if candidates is not None:
+            perms = candidates
+            total = len(candidates)
+    # The swap count only depends on the sequence of physical qubit pairs the
+    # two-qubit gates are mapped onto. Permutations inducing a signature that
+    # was already dispatched reuse its result instead of transpiling again.
+    pairs = get_interaction_pairs(qc)
+    keys = []
+    assign = []
+    seen = {}
+    owners = []
+    resumed = {}
+
+    # Per-iteration tqdm updates cost a syscall each, which adds up to seconds
+    # over millions of permutations; batch the updates instead.
+    progress = tqdm(total=total)
+    pending_updates = 0
+
+    # `perms` may be a lazy generator (n! entries would not fit in memory as a
+    # list); dedupe and record each permutation as it is dispatched.
+    def unique(iterable):
+        nonlocal pending_updates
+        for perm in iterable:
+            perm = tuple(perm)
+            pending_updates += 1
+            if pending_updates >= 10000:
+                progress.update(pending_updates)
+                pending_updates = 0
+            if precomputed is not None and perm in precomputed:
+                resumed[perm] = precomputed[perm]
+                continue
+            keys.append(perm)
+            signature = tuple(tuple(sorted((perm[a], perm[b]))) for a, b in pairs)
+            idx = seen.get(signature)
+            if idx is None:
+                idx = len(seen)
+                seen[signature] = idx
+                assign.append(idx)
+                owners.append(perm)
+                yield perm
+            else:
+                assign.append(idx)
+
+    # Large chunks amortize the per-task IPC; the circuit and coupling map are
+    # shipped once per worker through the pool initializer (as qpy bytes - far
+    # cheaper to encode than a recursive circuit pickle). Swap counts
+    # accumulate into a growable int16 buffer (2 bytes/entry).
+    buf = io.BytesIO()
+    qpy.dump(qc, buf)
+    pool = _get_score_pool(buf.getvalue(), coupling, dist_matrix)
+    chunksize = max(1, (total or 4096) // (8 * 64))
+    swaps = np.empty(4096, dtype=np.int16)
+    n_done = 0
+    early_exit = False
+
+    def chunked(iterable):
+        # Each task ships one contiguous int16 matrix: ~40x less pickled bytes
+        # than a list of refcounted int tuples.
+        iterator = iter(iterable)
+        while True:
+            block = list(itertools.islice(iterator, chunksize))
+            if not block:
+                return
+            yield np.asarray(block, dtype=np.int16), seed
+
+    for chunk_counts in pool.imap(_score_permutations, chunked(unique(perms))):
+        for swap_count in chunk_counts:
+            if n_done == len(swaps):
+                swaps = np.resize(swaps, 2 * len(swaps))
+            swaps[n_done] = swap_count
+            n_done += 1
+            if stop_on_zero and swap_count == 0:
+                early_exit = True
+                break
+            if flush_path is not None and n_done % flush_every == 0:
+                partial = dict(zip(owners, swaps[:n_done].tolist()))
+                partial.update(resumed)
+                with open(flush_path, "wb") as handle:
+                    pickle.dump(partial, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        if early_exit:
+            break
+    if early_exit:
+        # Abandoning the imap iterator leaves queued chunks behind; drop the
+        # pool so the next search starts clean.
+        _shutdown_score_pool()
+    progress.update(pending_updates)
+    progress.close()
+
+    outputs = swaps[:n_done].tolist()
+    # On early exit the dispatcher may have run ahead of the scored results;
+    # only keyed entries whose evaluation completed make it into the dict.
+    result_dict = {perm: outputs[assign[i]] for i, perm in enumerate(keys) if assign[i] < n_done}
+    result_dict.update(resumed)
 
     return result_dict
 
 
+@functools.lru_cache(maxsize=128)
+def cached_get_benchmark(alg: str, mode: str, size: int):
+    """
+    Content-keyed cache around mqt.bench.get_benchmark: generation (heavy library
+    expansion for e.g. Grover) runs once per (alg, mode, size) per process via the
+    lru_cache, and the qpy copy under bench_cache/ survives across runs.
+    """
+    from mqt.bench import get_benchmark
+    path = os.path.join("bench_cache", "{}_{}_{}.qpy".format(alg, mode, size))
+    try:
+        with open(path, "rb") as handle:
+            return qpy.load(handle)[0]
+    except OSError:
+        pass
+    circ = get_benchmark(alg, mode, size)
+    os.makedirs("bench_cache", exist_ok=True)
+    with open(path, "wb") as handle:
+        qpy.dump(circ, handle)
+    return circ
+
+
+@functools.lru_cache(maxsize=None)
 def get_qaoa_circuit(num_qubits: int):
+    # The QAOA construction runs a Sampler round trip; one build per size is
+    # plenty for a sweep. Callers that mutate the circuit should copy it.
     qp = get_examplary_max_cut_qp(num_qubits)
     qaoa = QAOA(sampler=Sampler(), reps=2, optimizer=SLSQP(maxiter=0))
     qaoa_result = qaoa.compute_minimum_eigenvalue(qp.to_ising()[0])
@@ -40,28 +417,36 @@ def get_qaoa_circuit(num_qubits: int):
     qc = qc.decompose().decompose()
     return qc
 
+@functools.lru_cache(maxsize=None)
+def _vqe_template(num_qubits: int):
+    # The decomposition is the expensive step and is structurally identical
+    # across seeds; only the rotation angles differ, so keep one parametrized
+    # template per size.
+    ansatz = RealAmplitudes(num_qubits, reps=2)
+    return ansatz.decompose()
+
+
 def get_vqe_circuit(num_qubits: int):
     # TODO: Look at the circuit again
-    ansatz = RealAmplitudes(num_qubits, reps=2)
-    ansatz.bind_parameters(np.random.uniform(low=-2, high=2, size=(ansatz.num_parameters,)))
+    template = _vqe_template(num_qubits)
+    ansatz = template.assign_parameters(np.random.uniform(low=-2, high=2, size=(template.num_parameters,)),
+                                        inplace=False)
     ansatz.name = "vqe"
-    ansatz = ansatz.decompose()
     return ansatz
 
 
-def find_layout_bounds(result_dict: dict):
-    # Find the best layout
-    min = float("inf")
-    max = float('-inf')
-    best_perm = None
-    worst_perm = None
-    for p in result_dict:
-        if result_dict[p] < min:
-            min = result_dict[p]
-            best_perm = p
-
-        if result_dict[p] > max:
-            max = result_dict[p]
-            worst_perm = p
+def find_layout_bounds(result_dict):
+    # Array form ((N, k) layouts, (N,) swap counts) as stored on disk: the
+    # bounds are a single argmin/argmax.
+    if isinstance(result_dict, tuple):
+        perms, swaps = result_dict
+        return (tuple(perms[int(np.argmin(swaps))].tolist()),
+                tuple(perms[int(np.argmax(swaps))].tolist()))
 
-    return best_perm, worst_perm
\ No newline at end of file
+    # Dict form: one C-level reduction over a contiguous buffer instead of a
+    # Python compare per permutation.
+    if not result_dict:
+        return None, None
+    keys = list(result_dict.keys())
+    vals = np.fromiter(result_dict.values(), dtype=np.int32, count=len(result_dict))
+    return keys[int(vals.argmin())], keys[int(vals.argmax())]
\ No newline at end of file